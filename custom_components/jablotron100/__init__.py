@@ -23,7 +23,7 @@ async def async_setup_entry(hass: core.HomeAssistant, config_entry: config_entri
 	hass.data.setdefault(DOMAIN, {})
 
 	jablotron = Jablotron(hass, config_entry.data, config_entry.options)
-	jablotron.initialize()
+	await hass.async_add_executor_job(jablotron.initialize)
 
 	hass.data[DOMAIN][config_entry.entry_id] = {
 		DATA_JABLOTRON: jablotron,
@@ -56,7 +56,7 @@ async def async_unload_entry(hass: core.HomeAssistant, config_entry: config_entr
 	options_update_unsubscriber()
 
 	jablotron = hass.data[DOMAIN][config_entry.entry_id][DATA_JABLOTRON]
-	jablotron.shutdown()
+	await hass.async_add_executor_job(jablotron.shutdown)
 
 	return True
 
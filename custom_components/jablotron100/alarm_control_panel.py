@@ -66,7 +66,7 @@ class JablotronAlarmControlPanelEntity(JablotronEntity, AlarmControlPanelEntity)
 			return
 
 		self._arming_in_progress = False
-		self._jablotron.modify_alarm_control_panel_section_state(self._control.section, STATE_ALARM_DISARMED, code)
+		await self.hass.async_add_executor_job(self._jablotron.modify_alarm_control_panel_section_state, self._control.section, STATE_ALARM_DISARMED, code)
 		self.update_state(STATE_ALARM_DISARMED)
 
 	async def async_alarm_arm_away(self, code: Optional[str] = None) -> None:
@@ -80,7 +80,7 @@ class JablotronAlarmControlPanelEntity(JablotronEntity, AlarmControlPanelEntity)
 
 		self._arming_in_progress = True
 		self.update_state(STATE_ALARM_ARMING)
-		self._jablotron.modify_alarm_control_panel_section_state(self._control.section, STATE_ALARM_ARMED_AWAY, code)
+		await self.hass.async_add_executor_job(self._jablotron.modify_alarm_control_panel_section_state, self._control.section, STATE_ALARM_ARMED_AWAY, code)
 
 	async def async_alarm_arm_night(self, code: Optional[str] = None) -> None:
 		if self.state == STATE_ALARM_ARMED_NIGHT or self.state == STATE_ALARM_ARMED_AWAY:
@@ -93,7 +93,7 @@ class JablotronAlarmControlPanelEntity(JablotronEntity, AlarmControlPanelEntity)
 
 		self._arming_in_progress = True
 		self.update_state(STATE_ALARM_ARMING)
-		self._jablotron.modify_alarm_control_panel_section_state(self._control.section, STATE_ALARM_ARMED_NIGHT, code)
+		await self.hass.async_add_executor_job(self._jablotron.modify_alarm_control_panel_section_state, self._control.section, STATE_ALARM_ARMED_NIGHT, code)
 
 	def _device_id(self) -> str:
 		return self._control.name
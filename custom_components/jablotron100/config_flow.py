@@ -47,7 +47,7 @@ class JablotronConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 				await self.async_set_unique_id(unique_id)
 				self._abort_if_unique_id_configured()
 
-				check_serial_port(user_input[CONF_SERIAL_PORT])
+				await self.hass.async_add_executor_job(check_serial_port, user_input[CONF_SERIAL_PORT])
 
 				self._config = {
 					CONF_SERIAL_PORT: user_input[CONF_SERIAL_PORT],
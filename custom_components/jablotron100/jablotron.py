@@ -1,5 +1,8 @@
+import array
 import binascii
 from concurrent.futures import ThreadPoolExecutor
+import fcntl
+import functools
 from homeassistant import core
 from homeassistant.const import (
 	CONF_PASSWORD,
@@ -14,11 +17,14 @@ from homeassistant.const import (
 	STATE_ON,
 )
 from homeassistant.helpers.entity import Entity
+import logging
+import os
 import re
-import sys
+import termios
 import threading
 import time
-from typing import Any, Dict, List, Optional
+import tty
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 from .const import (
 	CONF_DEVICES,
 	CONF_NUMBER_OF_DEVICES,
@@ -42,10 +48,18 @@ from .errors import (
 	ShouldNotHappen,
 )
 
-MAX_WORKERS = 5
+MAX_WORKERS = 2
 TIMEOUT = 10
+KEEPALIVE_INTERVAL = 1
+LONG_KEEPALIVE_INTERVAL = 60
 PACKET_READ_SIZE = 64
 
+# From linux/serial.h
+ASYNC_LOW_LATENCY = 1 << 13
+SERIAL_STRUCT_FLAGS_INDEX = 4
+
+SUPPORTED_MODEL_REGEX = re.compile(r"^JA-10[1367]")
+
 # x02 model
 # x08 hardware version
 # x09 firmware version
@@ -58,13 +72,21 @@ JABLOTRON_PACKET_SECTIONS_STATES_PREFIX = b"\x51\x22"
 JABLOTRON_PACKET_DEVICES_STATES_PREFIX = b"\xd8"
 JABLOTRON_PACKET_WIRED_DEVICE_STATE_PREFIX = b"\x55\x08"
 JABLOTRON_PACKET_WIRELESS_DEVICE_STATE_PREFIX = b"\x55\x09"
+JABLOTRON_PACKET_DEVICE_STATE_PREFIXES = (JABLOTRON_PACKET_WIRED_DEVICE_STATE_PREFIX, JABLOTRON_PACKET_WIRELESS_DEVICE_STATE_PREFIX)
 JABLOTRON_PACKET_INFO_PREFIX = b"\x40"
+JABLOTRON_PACKET_CODE_PREFIX = b"\x80\x08\x03\x39\x39\x39"
 JABLOTRON_INFO_MODEL = b"\x02"
 JABLOTRON_INFO_HARDWARE_VERSION = b"\x08"
 JABLOTRON_INFO_FIRMWARE_VERSION = b"\x09"
 JABLOTRON_INFO_REGISTRATION_CODE = b"\x0a"
 JABLOTRON_INFO_INSTALLATION_NAME = b"\x0b"
 
+JABLOTRON_SECTION_STATE_PACKETS = {
+	STATE_ALARM_DISARMED: 143,
+	STATE_ALARM_ARMED_AWAY: 159,
+	STATE_ALARM_ARMED_NIGHT: 175,
+}
+
 JABLOTRON_PRIMARY_STATE_DISARMED = 1
 JABLOTRON_PRIMARY_STATE_ARMED_PARTIALLY = 2
 JABLOTRON_PRIMARY_STATE_ARMED_FULL = 3
@@ -79,54 +101,70 @@ JABLOTRON_TERTIARY_STATE_OFF = 0
 JABLOTRON_TERTIARY_STATE_ON = 1
 
 def decode_info_bytes(value: bytes) -> str:
-	info = ""
+	end = len(value)
+
+	for terminator in (b"\x00", JABLOTRON_PACKET_INFO_PREFIX):
+		terminator_index = value.find(terminator, 0, end)
+
+		if terminator_index != -1:
+			end = terminator_index
 
-	for i in range(len(value)):
-		letter = value[i:(i + 1)]
+	return value[:end].decode("ascii", errors="ignore")
 
-		if letter == b"\x00" or letter == JABLOTRON_PACKET_INFO_PREFIX:
-			break
+def open_serial_port(serial_port: str) -> int:
+	serial_fd = os.open(serial_port, os.O_RDWR | os.O_NOCTTY)
 
-		info += letter.decode()
+	# hidraw devices are not TTYs so there is nothing to configure
+	if os.isatty(serial_fd):
+		tty.setraw(serial_fd, termios.TCSANOW)
+		enable_low_latency(serial_fd)
 
-	return info
+	return serial_fd
+
+def enable_low_latency(serial_fd: int) -> None:
+	# USB-serial converters buffer reads for 16 ms by default
+	serial_struct = array.array("i", [0] * 32)
+
+	try:
+		fcntl.ioctl(serial_fd, termios.TIOCGSERIAL, serial_struct)
+		serial_struct[SERIAL_STRUCT_FLAGS_INDEX] |= ASYNC_LOW_LATENCY
+		fcntl.ioctl(serial_fd, termios.TIOCSSERIAL, serial_struct)
+	except OSError as ex:
+		LOGGER.debug("Low latency mode not available: {}".format(format(ex)))
 
 def check_serial_port(serial_port: str) -> None:
+	try:
+		serial_fd = open_serial_port(serial_port)
+	except OSError:
+		raise ServiceUnavailable
+
 	stop_event = threading.Event()
 	thread_pool_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
 	def reader_thread() -> Optional[str]:
 		model = None
 
-		stream = open(serial_port, "rb")
+		while not stop_event.is_set():
+			packet = os.read(serial_fd, PACKET_READ_SIZE)
 
-		try:
-			while not stop_event.is_set():
-				packet = stream.read(PACKET_READ_SIZE)
+			if LOGGER.isEnabledFor(logging.DEBUG):
 				LOGGER.debug(str(binascii.hexlify(packet), "utf-8"))
 
-				if packet[:1] == JABLOTRON_PACKET_INFO_PREFIX and packet[2:3] == JABLOTRON_INFO_MODEL:
-					try:
-						model = decode_info_bytes(packet[3:])
-						break
-					except UnicodeDecodeError:
-						# Try again
-						pass
-		finally:
-			stream.close()
+			if packet[:1] == JABLOTRON_PACKET_INFO_PREFIX and packet[2:3] == JABLOTRON_INFO_MODEL:
+				model = decode_info_bytes(packet[3:])
+
+				if model != "":
+					break
+
+				# Try again
+				model = None
 
 		return model
 
 	def writer_thread() -> None:
 		while not stop_event.is_set():
-			stream = open(serial_port, "wb")
-
-			stream.write(JABLOTRON_PACKET_GET_MODEL)
-			time.sleep(0.1)
-
-			stream.close()
-
-			time.sleep(1)
+			os.write(serial_fd, JABLOTRON_PACKET_GET_MODEL)
+			stop_event.wait(1)
 
 	try:
 		reader = thread_pool_executor.submit(reader_thread)
@@ -137,7 +175,7 @@ def check_serial_port(serial_port: str) -> None:
 		if model is None:
 			raise ModelNotDetected
 
-		if not re.match(r"^JA-10[1367]", model):
+		if not SUPPORTED_MODEL_REGEX.match(model):
 			LOGGER.debug("Unsupported model: {}", model)
 			raise ModelNotSupported("Model {} not supported".format(model))
 
@@ -147,6 +185,7 @@ def check_serial_port(serial_port: str) -> None:
 	finally:
 		stop_event.set()
 		thread_pool_executor.shutdown()
+		os.close(serial_fd)
 
 
 class JablotronCentralUnit:
@@ -198,11 +237,33 @@ class Jablotron():
 
 		self._entities: Dict[str, JablotronEntity] = {}
 
+		self._section_alarm_ids: List[str] = []
+		self._section_problem_sensor_ids: List[str] = []
+		self._device_sensor_ids: List[str] = []
+		self._device_problem_sensor_ids: List[str] = []
+
+		self._serial_fd: Optional[int] = None
+		self._serial_write_lock: threading.Lock = threading.Lock()
+
 		self._state_checker_thread_pool_executor: Optional[ThreadPoolExecutor] = None
 		self._state_checker_stop_event: threading.Event = threading.Event()
-		self._state_checker_data_updating_event: threading.Event = threading.Event()
+		self._state_checker_data_updating_condition: threading.Condition = threading.Condition()
+
+		# Commands are built from these so nothing has to be encoded when arming or disarming
+		self._default_code_packet: Optional[bytes] = None
+		self._section_state_packets: Dict[str, List[bytes]] = {
+			state: [b"\x80\x02\x0d" + bytes([state_packet + section]) for section in range(MAX_SECTIONS + 1)]
+			for state, state_packet in JABLOTRON_SECTION_STATE_PACKETS.items()
+		}
+
+		self._packet_parsers: Dict[bytes, Callable[[bytes], None]] = {
+			JABLOTRON_PACKET_SECTIONS_STATES_PREFIX: self._parse_section_states_packet,
+			JABLOTRON_PACKET_WIRED_DEVICE_STATE_PREFIX: self._parse_device_state_packet,
+			JABLOTRON_PACKET_WIRELESS_DEVICE_STATE_PREFIX: self._parse_device_state_packet,
+		}
 
 		self.states: Dict[str, str] = {}
+		self._pending_writes: Set[str] = set()
 		self.last_update_success: bool = False
 
 	def update_options(self, options: Dict[str, Any]) -> None:
@@ -219,10 +280,30 @@ class Jablotron():
 		def shutdown_event(_):
 			self.shutdown()
 
-		self._hass.bus.async_listen(EVENT_HOMEASSISTANT_STOP, shutdown_event)
+		self._hass.bus.listen(EVENT_HOMEASSISTANT_STOP, shutdown_event)
+
+		try:
+			self._serial_fd = open_serial_port(self._config[CONF_SERIAL_PORT])
+		except OSError as ex:
+			LOGGER.error(format(ex))
+			raise ServiceUnavailable
+
+		# Detection needs just a reader and a writer
+		detection_thread_pool_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+		detected = False
+
+		try:
+			self._central_unit, section_states = self._detect_central_unit_and_sections(detection_thread_pool_executor)
+			detected = True
+		finally:
+			# The reader has to finish before its file descriptor can be closed
+			detection_thread_pool_executor.shutdown()
+
+			if not detected:
+				self._close_serial_port()
 
-		self._detect_central_unit()
-		self._detect_sections()
+		self._create_sections(section_states)
 		self._create_devices()
 
 		# Initialize states checker
@@ -236,30 +317,29 @@ class Jablotron():
 		return self._central_unit
 
 	def shutdown(self) -> None:
+		if self._serial_fd is None:
+			return
+
 		self._state_checker_stop_event.set()
 
+		with self._state_checker_data_updating_condition:
+			self._state_checker_data_updating_condition.notify_all()
+
 		# Send packet so read thread can finish
 		self._send_packet(JABLOTRON_PACKET_GET_SECTIONS_STATES)
 
 		if self._state_checker_thread_pool_executor is not None:
 			self._state_checker_thread_pool_executor.shutdown()
 
+		self._close_serial_port()
+
 	def substribe_entity_for_updates(self, control_id: str, entity) -> None:
 		self._entities[control_id] = entity
 
 	def modify_alarm_control_panel_section_state(self, section: int, state: str, code: Optional[str]) -> None:
-		if code is None:
-			code = self._config[CONF_PASSWORD]
-
-		int_packets = {
-			STATE_ALARM_DISARMED: 143,
-			STATE_ALARM_ARMED_AWAY: 159,
-			STATE_ALARM_ARMED_NIGHT: 175,
-		}
-
-		state_packet = Jablotron._int_to_bytes(int_packets[state] + section)
+		code_packet = self._get_default_code_packet() if code is None else self._create_code_packet(code)
 
-		self._send_packet(self._create_code_packet(code) + b"\x80\x02\x0d" + state_packet)
+		self._send_packet(code_packet + self._section_state_packets[state][section])
 
 	def alarm_control_panels(self) -> List[JablotronAlarmControlPanel]:
 		return self._alarm_control_panels
@@ -274,112 +354,99 @@ class Jablotron():
 		return self._device_problem_sensors
 
 	def _update_all_entities(self) -> None:
-		for entity in self._entities.values():
-			entity.async_write_ha_state()
-
-	def _detect_central_unit(self) -> None:
-		stop_event = threading.Event()
-		thread_pool_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+		# Called from the reader thread too
+		self._hass.loop.call_soon_threadsafe(Jablotron._write_entities_states, list(self._entities.values()))
 
-		def reader_thread() -> Optional[JablotronCentralUnit]:
-			model = None
-			hardware_version = None
-			firmware_version = None
-
-			stream = open(self._config[CONF_SERIAL_PORT], "rb")
+	def _flush_updates(self) -> None:
+		if not self._pending_writes:
+			return
 
-			try:
-				while not stop_event.is_set():
-					packet = stream.read(PACKET_READ_SIZE)
-					LOGGER.debug(str(binascii.hexlify(packet), "utf-8"))
-
-					if packet[:1] == JABLOTRON_PACKET_INFO_PREFIX:
-						info_packets = []
-
-						for i in range(len(packet)):
-							prefix = packet[i:(i + 1)]
-
-							if prefix == JABLOTRON_PACKET_INFO_PREFIX:
-								info_packets.append(packet[i:])
-
-						for info_packet in info_packets:
-							try:
-								if info_packet[2:3] == JABLOTRON_INFO_MODEL:
-									model = decode_info_bytes(info_packet[3:])
-								elif info_packet[2:3] == JABLOTRON_INFO_HARDWARE_VERSION:
-									hardware_version = decode_info_bytes(info_packet[3:])
-								elif info_packet[2:3] == JABLOTRON_INFO_FIRMWARE_VERSION:
-									firmware_version = decode_info_bytes(info_packet[3:])
-							except UnicodeDecodeError:
-								# Try again
-								pass
-
-					if model is not None and hardware_version is not None and firmware_version is not None:
-						break
-			finally:
-				stream.close()
+		entities = []
 
-			if model is None or hardware_version is None or firmware_version is None:
-				return None
+		for id in self._pending_writes:
+			entity = self._entities.get(id)
 
-			return JablotronCentralUnit(self._config[CONF_SERIAL_PORT], model, hardware_version, firmware_version)
+			if entity is not None:
+				entities.append(entity)
 
-		def writer_thread() -> None:
-			while not stop_event.is_set():
-				self._send_packet(JABLOTRON_PACKET_GET_INFO)
-				time.sleep(1)
+		self._pending_writes.clear()
 
-		try:
-			reader = thread_pool_executor.submit(reader_thread)
-			thread_pool_executor.submit(writer_thread)
+		self._hass.loop.call_soon_threadsafe(Jablotron._write_entities_states, entities)
 
-			self._central_unit = reader.result(TIMEOUT)
+	def _detect_central_unit_and_sections(self, thread_pool_executor: ThreadPoolExecutor) -> Tuple[JablotronCentralUnit, List[Tuple[int, bytes]]]:
+		stop_event = threading.Event()
 
-		except (IndexError, FileNotFoundError, IsADirectoryError, UnboundLocalError, OSError) as ex:
-			LOGGER.error(format(ex))
-			raise ServiceUnavailable
+		def reader_thread() -> Optional[Tuple[JablotronCentralUnit, List[Tuple[int, bytes]]]]:
+			model = None
+			hardware_version = None
+			firmware_version = None
+			section_states = None
 
-		finally:
-			stop_event.set()
-			thread_pool_executor.shutdown()
+			buffer = bytearray()
 
-		if self._central_unit is None:
-			raise ShouldNotHappen
+			while not stop_event.is_set():
+				read_bytes = os.read(self._serial_fd, PACKET_READ_SIZE)
 
-	def _detect_sections(self) -> None:
-		stop_event = threading.Event()
-		thread_pool_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+				if LOGGER.isEnabledFor(logging.DEBUG):
+					LOGGER.debug(str(binascii.hexlify(read_bytes), "utf-8"))
 
-		def reader_thread() -> Optional[Dict[int, bytes]]:
-			section_states = None
+				# Info and sections states replies can share one read
+				buffer += read_bytes
 
-			stream = open(self._config[CONF_SERIAL_PORT], "rb")
+				while True:
+					packet = Jablotron._extract_packet(buffer)
 
-			try:
-				while not stop_event.is_set():
-					packet = stream.read(PACKET_READ_SIZE)
+					if packet is None:
+						break
 
 					if packet[:2] == JABLOTRON_PACKET_SECTIONS_STATES_PREFIX:
 						section_states = Jablotron._parse_sections_states_packet(packet)
-						break
-			finally:
-				stream.close()
+						continue
+
+					if packet[:1] != JABLOTRON_PACKET_INFO_PREFIX:
+						continue
+
+					info = decode_info_bytes(packet[3:])
 
-			if section_states is None:
+					if info == "":
+						# Try again
+						continue
+
+					if packet[2:3] == JABLOTRON_INFO_MODEL:
+						model = info
+					elif packet[2:3] == JABLOTRON_INFO_HARDWARE_VERSION:
+						hardware_version = info
+					elif packet[2:3] == JABLOTRON_INFO_FIRMWARE_VERSION:
+						firmware_version = info
+
+				if (
+					model is not None
+					and hardware_version is not None
+					and firmware_version is not None
+					and section_states is not None
+				):
+					break
+
+			if (
+				model is None
+				or hardware_version is None
+				or firmware_version is None
+				or section_states is None
+			):
 				return None
 
-			return section_states
+			return JablotronCentralUnit(self._config[CONF_SERIAL_PORT], model, hardware_version, firmware_version), section_states
 
 		def writer_thread() -> None:
 			while not stop_event.is_set():
-				self._send_packet(JABLOTRON_PACKET_GET_SECTIONS_STATES)
-				time.sleep(1)
+				self._send_packet(JABLOTRON_PACKET_GET_INFO + JABLOTRON_PACKET_GET_SECTIONS_STATES)
+				stop_event.wait(1)
 
 		try:
 			reader = thread_pool_executor.submit(reader_thread)
 			thread_pool_executor.submit(writer_thread)
 
-			section_states = reader.result(TIMEOUT)
+			detected = reader.result(TIMEOUT)
 
 		except (IndexError, FileNotFoundError, IsADirectoryError, UnboundLocalError, OSError) as ex:
 			LOGGER.error(format(ex))
@@ -387,14 +454,20 @@ class Jablotron():
 
 		finally:
 			stop_event.set()
-			thread_pool_executor.shutdown()
 
-		if section_states is None:
+		if detected is None:
 			raise ShouldNotHappen
 
-		for section, section_state in section_states.items():
-			section_alarm_id = Jablotron._create_section_alarm_id(section)
-			section_problem_sensor_id = Jablotron._create_section_problem_sensor_id(section)
+		return detected
+
+	def _create_sections(self, section_states: List[Tuple[int, bytes]]) -> None:
+		# Indexed by section number so the state parsing does not have to format ids
+		self._section_alarm_ids = [Jablotron._create_section_alarm_id(section) for section in range(MAX_SECTIONS + 1)]
+		self._section_problem_sensor_ids = [Jablotron._create_section_problem_sensor_id(section) for section in range(MAX_SECTIONS + 1)]
+
+		for section, section_state in section_states:
+			section_alarm_id = self._section_alarm_ids[section]
+			section_problem_sensor_id = self._section_problem_sensor_ids[section]
 
 			self._alarm_control_panels.append(JablotronAlarmControlPanel(
 				self._central_unit,
@@ -408,10 +481,13 @@ class Jablotron():
 				section_problem_sensor_id,
 			))
 
-			self.states[section_alarm_id] = Jablotron._convert_jablotron_alarm_state_to_alarm_state(section_state)
-			self.states[section_problem_sensor_id] = Jablotron._convert_jablotron_alarm_state_to_problem_sensor_state(section_state)
+			self.states[section_alarm_id], self.states[section_problem_sensor_id] = Jablotron._convert_jablotron_alarm_state_to_states(section_state)
 
 	def _create_devices(self) -> None:
+		# Indexed by device number so the state parsing does not have to format ids
+		self._device_sensor_ids = [Jablotron._create_device_sensor_id(number) for number in range(self._config[CONF_NUMBER_OF_DEVICES] + 1)]
+		self._device_problem_sensor_ids = [Jablotron._create_device_problem_sensor_id(number) for number in range(self._config[CONF_NUMBER_OF_DEVICES] + 1)]
+
 		for i in range(self._config[CONF_NUMBER_OF_DEVICES]):
 			type = self._config[CONF_DEVICES][i]
 
@@ -425,8 +501,8 @@ class Jablotron():
 			number = i + 1
 
 			device_name = Jablotron._create_device_sensor_name(type, number)
-			device_id = Jablotron._create_device_sensor_id(number)
-			device_problem_sensor_id = Jablotron._create_device_problem_sensor_id(number)
+			device_id = self._device_sensor_ids[number]
+			device_problem_sensor_id = self._device_problem_sensor_ids[number]
 
 			self._device_sensors.append(JablotronDevice(
 				self._central_unit,
@@ -445,112 +521,132 @@ class Jablotron():
 			self.states[device_problem_sensor_id] = STATE_OFF
 
 	def _read_packets(self) -> None:
-		stream = open(self._config[CONF_SERIAL_PORT], "rb")
+		buffer = bytearray()
 
 		while not self._state_checker_stop_event.is_set():
 
 			try:
+				read_bytes = os.read(self._serial_fd, PACKET_READ_SIZE)
 
-				while True:
-
-					self._state_checker_data_updating_event.clear()
+				if LOGGER.isEnabledFor(logging.DEBUG):
+					LOGGER.debug(str(binascii.hexlify(read_bytes), "utf-8"))
 
-					packet = stream.read(PACKET_READ_SIZE)
-					# LOGGER.debug(str(binascii.hexlify(packet), "utf-8"))
+				with self._state_checker_data_updating_condition:
+					self._state_checker_data_updating_condition.notify_all()
 
-					self._state_checker_data_updating_event.set()
+				if not read_bytes:
+					buffer.clear()
+					self.last_update_success = False
+					self._update_all_entities()
+					# Do not spin while the device is gone
+					self._state_checker_stop_event.wait(0.5)
+					continue
 
-					if not packet:
-						self.last_update_success = False
-						self._update_all_entities()
-						break
+				self.last_update_success = True
 
-					self.last_update_success = True
+				# One read can end in the middle of a packet or contain several of them
+				buffer += read_bytes
 
-					prefix = packet[:2]
+				while True:
+					packet = Jablotron._extract_packet(buffer)
 
-					if prefix == JABLOTRON_PACKET_SECTIONS_STATES_PREFIX:
-						self._parse_section_states_packet(packet)
+					if packet is None:
 						break
 
-					if (Jablotron._is_device_state_packet(prefix)):
-						self._parse_device_state_packet(packet)
-						break
+					packet_parser = self._packet_parsers.get(packet[:2])
 
-					if packet[:1] == JABLOTRON_PACKET_DEVICES_STATES_PREFIX:
+					if packet_parser is not None:
+						packet_parser(packet)
+					elif packet[:1] == JABLOTRON_PACKET_DEVICES_STATES_PREFIX:
 						self._parse_devices_states_packet(packet)
-						break
+
+				self._flush_updates()
 
 			except Exception as ex:
+				buffer.clear()
 				LOGGER.error("Read error: {}".format(format(ex)))
 				self.last_update_success = False
 				self._update_all_entities()
-
-			time.sleep(0.5)
-
-		stream.close()
+				# Do not spin while the device is failing
+				self._state_checker_stop_event.wait(0.5)
 
 	def _keepalive(self):
-		counter = 0
+		next_long_keepalive = time.monotonic()
+
 		while not self._state_checker_stop_event.is_set():
-			if not self._state_checker_data_updating_event.wait(0.5):
-				try:
-					if counter == 0:
-						self._send_packet(self._create_code_packet(self._config[CONF_PASSWORD]) + b"\x52\x02\x13\x05\x9a")
-					else:
-						self._send_packet(b"\x52\x01\x02")
-				except Exception as ex:
-					LOGGER.error("Write error: {}".format(format(ex)))
-
-			time.sleep(1)
-			counter += 1
-			if counter == 60:
-				counter = 0
+			with self._state_checker_data_updating_condition:
+				data_updated = self._state_checker_data_updating_condition.wait(KEEPALIVE_INTERVAL)
+
+			# Keepalive is needed only when the central unit is silent
+			if data_updated or self._state_checker_stop_event.is_set():
+				continue
+
+			try:
+				if time.monotonic() >= next_long_keepalive:
+					self._send_packet(self._get_default_code_packet() + b"\x52\x02\x13\x05\x9a")
+					next_long_keepalive = time.monotonic() + LONG_KEEPALIVE_INTERVAL
+				else:
+					self._send_packet(b"\x52\x01\x02")
+			except Exception as ex:
+				LOGGER.error("Write error: {}".format(format(ex)))
 
 	def _send_packet(self, packet) -> None:
-		stream = open(self._config[CONF_SERIAL_PORT], "wb")
+		with self._serial_write_lock:
+			os.write(self._serial_fd, packet)
 
-		stream.write(packet)
-		time.sleep(0.1)
+	def _close_serial_port(self) -> None:
+		if self._serial_fd is None:
+			return
 
-		stream.close()
+		os.close(self._serial_fd)
+		self._serial_fd = None
 
 	def _update_state(self, id: str, state: str) -> None:
-		if id in self.states and state == self.states[id]:
+		if self.states.get(id) == state:
 			return
 
 		self.states[id] = state
-
-		if id in self._entities:
-			self._entities[id].async_write_ha_state()
+		self._pending_writes.add(id)
 
 	def _parse_section_states_packet(self, packet: bytes) -> None:
-		section_states = Jablotron._parse_sections_states_packet(packet)
+		for section in range(1, MAX_SECTIONS + 1):
+			state_offset = section * 2
+			section_state = packet[state_offset:(state_offset + 2)]
+
+			# Unused section
+			if section_state == b"\x07\x00":
+				break
+
+			alarm_state, problem_sensor_state = Jablotron._convert_jablotron_alarm_state_to_states(section_state)
 
-		for section, section_state in section_states.items():
 			self._update_state(
-				Jablotron._create_section_alarm_id(section),
-				Jablotron._convert_jablotron_alarm_state_to_alarm_state(section_state),
+				self._section_alarm_ids[section],
+				alarm_state,
 			)
 
 			self._update_state(
-				Jablotron._create_section_problem_sensor_id(section),
-				Jablotron._convert_jablotron_alarm_state_to_problem_sensor_state(section_state),
+				self._section_problem_sensor_ids[section],
+				problem_sensor_state,
 			)
 
 	def _parse_device_state_packet(self, packet: bytes) -> None:
 		device_number = Jablotron._parse_device_number_from_state_packet(packet)
+
+		# Device is not configured
+		if device_number >= len(self._device_sensor_ids):
+			return
+
 		device_state = Jablotron._convert_jablotron_device_state_to_state(packet, device_number)
 		device_problem_sensor_state = Jablotron._convert_jablotron_device_state_to_problem_sensor_state(packet)
 
 		self._update_state(
-			Jablotron._create_device_problem_sensor_id(device_number),
+			self._device_problem_sensor_ids[device_number],
 			device_problem_sensor_state,
 		)
 
 		if device_state is not None:
 			self._update_state(
-				Jablotron._create_device_sensor_id(device_number),
+				self._device_sensor_ids[device_number],
 				device_state,
 			)
 		else:
@@ -558,22 +654,29 @@ class Jablotron():
 
 	def _parse_devices_states_packet(self, packet: bytes) -> None:
 		states_start_packet = 3
-		triggered_device_start_packet = states_start_packet + Jablotron._bytes_to_int(packet[1:2]) - 1
+		triggered_device_start_packet = states_start_packet + packet[1] - 1
 
-		states = Jablotron._hex_to_bin(packet[states_start_packet:triggered_device_start_packet])
+		states = int.from_bytes(packet[states_start_packet:triggered_device_start_packet], byteorder="little")
 
-		if Jablotron._is_device_state_packet(packet[triggered_device_start_packet:(triggered_device_start_packet + 2)]):
+		if packet[triggered_device_start_packet:(triggered_device_start_packet + 2)] in JABLOTRON_PACKET_DEVICE_STATE_PREFIXES:
 			self._parse_device_state_packet(packet[triggered_device_start_packet:])
 
 		for i in range(1, self._config[CONF_NUMBER_OF_DEVICES] + 1):
-			device_state = STATE_ON if states[i:(i + 1)] == "1" else STATE_OFF
+			device_state = STATE_ON if (states >> i) & 1 else STATE_OFF
 			self._update_state(
-				Jablotron._create_device_sensor_id(i),
+				self._device_sensor_ids[i],
 				device_state,
 			)
 
+	def _get_default_code_packet(self) -> bytes:
+		# Built on first use so an invalid password fails the command and not the setup
+		if self._default_code_packet is None:
+			self._default_code_packet = self._create_code_packet(self._config[CONF_PASSWORD])
+
+		return self._default_code_packet
+
 	def _create_code_packet(self, code: str) -> bytes:
-		code_packet = b"\x80\x08\x03\x39\x39\x39"
+		code_numbers = []
 
 		for i in range(0, 4):
 			j = i + 4
@@ -586,17 +689,53 @@ class Jablotron():
 			else:
 				code_number = int(f"{first_number}{second_number}", 16)
 
-			code_packet += Jablotron._int_to_bytes(code_number)
+			code_numbers.append(code_number)
 
-		return code_packet
+		return JABLOTRON_PACKET_CODE_PREFIX + bytes(code_numbers)
 
 	@staticmethod
-	def _is_device_state_packet(prefix) -> bool:
-		return prefix == JABLOTRON_PACKET_WIRED_DEVICE_STATE_PREFIX or prefix == JABLOTRON_PACKET_WIRELESS_DEVICE_STATE_PREFIX
+	def _extract_packet(buffer: bytearray) -> Optional[bytes]:
+		if len(buffer) == 0:
+			return None
+
+		if buffer[0] == 0:
+			# Padding - there are no more packets in the buffer
+			buffer.clear()
+			return None
+
+		if len(buffer) < 2:
+			return None
+
+		# Every packet is framed as type, length and payload
+		packet_length = buffer[1] + 2
+
+		# The triggered device state packet stays with the devices states packet because it has to be parsed first
+		if buffer[:1] == JABLOTRON_PACKET_DEVICES_STATES_PREFIX:
+			following_prefix = bytes(buffer[packet_length:(packet_length + 2)])
+
+			# Wait until it's clear whether the triggered device state packet follows
+			if len(following_prefix) < 2 and JABLOTRON_PACKET_WIRED_DEVICE_STATE_PREFIX.startswith(following_prefix):
+				return None
+
+			if following_prefix in JABLOTRON_PACKET_DEVICE_STATE_PREFIXES:
+				packet_length += buffer[packet_length + 1] + 2
+
+		if len(buffer) < packet_length:
+			return None
+
+		packet = bytes(buffer[:packet_length])
+		del buffer[:packet_length]
+
+		return packet
 
 	@staticmethod
-	def _parse_sections_states_packet(packet: bytes) -> Dict[int, bytes]:
-		section_states = {}
+	def _write_entities_states(entities: List["JablotronEntity"]) -> None:
+		for entity in entities:
+			entity.async_write_ha_state()
+
+	@staticmethod
+	def _parse_sections_states_packet(packet: bytes) -> List[Tuple[int, bytes]]:
+		section_states = []
 
 		for section in range(1, MAX_SECTIONS + 1):
 			state_offset = section * 2
@@ -606,17 +745,17 @@ class Jablotron():
 			if state == b"\x07\x00":
 				break
 
-			section_states[section] = state
+			section_states.append((section, state))
 
 		return section_states
 
 	@staticmethod
 	def _parse_device_number_from_state_packet(packet: bytes) -> int:
-		return int(Jablotron._bytes_to_int(packet[4:6]) / 64)
+		return int.from_bytes(packet[4:6], byteorder="little") >> 6
 
 	@staticmethod
 	def _convert_jablotron_device_state_to_state(packet: bytes, device_number: int) -> Optional[str]:
-		state = Jablotron._bytes_to_int(packet[3:4])
+		state = packet[3]
 
 		if device_number <= 32:
 			high_device_number_offset = 0
@@ -639,22 +778,6 @@ class Jablotron():
 
 		return None
 
-	@staticmethod
-	def _int_to_bytes(number: int) -> bytes:
-		return int.to_bytes(number, 1, byteorder=sys.byteorder)
-
-	@staticmethod
-	def _bytes_to_int(packet: bytes) -> int:
-		return int.from_bytes(packet, byteorder=sys.byteorder)
-
-	@staticmethod
-	def _hex_to_bin(hex):
-		dec = Jablotron._bytes_to_int(hex)
-		bin_dec = bin(dec)
-		bin_string = bin_dec[2:]
-		bin_string = bin_string.zfill(len(hex) * 8)
-		return bin_string[::-1]
-
 	@staticmethod
 	def _create_section_name(section: int) -> str:
 		return "Section {}".format(section)
@@ -687,6 +810,15 @@ class Jablotron():
 	def _create_device_problem_sensor_id(number: int) -> str:
 		return "device_problem_sensor_{}".format(number)
 
+	@staticmethod
+	@functools.lru_cache(maxsize=256)
+	def _convert_jablotron_alarm_state_to_states(packet: bytes) -> Tuple[str, str]:
+		# Sections report only a handful of distinct states so the conversion is cached
+		return (
+			Jablotron._convert_jablotron_alarm_state_to_alarm_state(packet),
+			Jablotron._convert_jablotron_alarm_state_to_problem_sensor_state(packet),
+		)
+
 	@staticmethod
 	def _convert_jablotron_alarm_state_to_alarm_state(packet: bytes) -> str:
 		state = Jablotron._parse_jablotron_alarm_state(packet)
@@ -724,21 +856,19 @@ class Jablotron():
 
 	@staticmethod
 	def _parse_jablotron_alarm_state(packet: bytes) -> Dict[str, int]:
-		first_packet = packet[0:1]
+		number = packet[0]
 
 		# Strange packet - converted to something that makes more sense
-		if first_packet == "\x1b":
-			first_packet = "\x13"
-
-		number = Jablotron._bytes_to_int(first_packet)
+		if number == 0x1b:
+			number = 0x13
 
 		primary_state = number % 16
-		secondary_state = int((number - primary_state) / 16)
+		secondary_state = (number - primary_state) // 16
 
 		return {
 			"primary": primary_state,
 			"secondary": secondary_state,
-			"tertiary": Jablotron._bytes_to_int(packet[1:2]),
+			"tertiary": packet[1],
 		}
 
 
@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("homeassistant")
+
+from custom_components.jablotron100.jablotron import Jablotron
+
+DEVICES_STATES_PACKET = b"\xd8\x02\x00\x02"
+DEVICE_STATE_PACKET = b"\x55\x08\x05\x6d\x40\x00\x00\x00\x00\x00"
+
+
+@pytest.mark.parametrize("split", [len(DEVICES_STATES_PACKET), len(DEVICES_STATES_PACKET) + 1])
+def test_extract_packet_waits_for_triggered_device_state_packet(split: int) -> None:
+	data = DEVICES_STATES_PACKET + DEVICE_STATE_PACKET
+	buffer = bytearray(data[:split])
+
+	assert Jablotron._extract_packet(buffer) is None
+
+	buffer += data[split:]
+
+	assert Jablotron._extract_packet(buffer) == data
+	assert buffer == bytearray()
+
+
+def test_extract_packet_without_triggered_device_state_packet() -> None:
+	buffer = bytearray(DEVICES_STATES_PACKET + b"\x00\x00")
+
+	assert Jablotron._extract_packet(buffer) == DEVICES_STATES_PACKET
+	assert Jablotron._extract_packet(buffer) is None
+	assert buffer == bytearray()